@@ -0,0 +1,120 @@
+"""語意向量與分數張量運算 (全部使用 PyTorch，依裝置放置)
+
+- 查詢編碼：Transformer 前向傳遞，受運算量限制，盡量批次處理
+- 相似度與 top-k：讀取整個目錄向量矩陣，受記憶體頻寬限制，向量預先正規化並留在裝置上
+"""
+import numpy as np
+import torch
+
+try:
+    import faiss
+except ImportError:     # 沒有安裝 FAISS 時一律暴力計算全部相似度
+    faiss = None
+
+# 目錄小於此筆數時暴力內積已經夠快，不建立 HNSW 索引
+HNSW_MIN_CATALOG_SIZE = 10000
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+def select_device():
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+def embedding_dtype(device):
+    """目錄向量的儲存精度：GPU 用 fp16 讓相似度計算的記憶體頻寬減半；CPU 沒有原生 fp16 運算反而較慢，維持 fp32"""
+    return torch.float16 if torch.device(device).type == "cuda" else torch.float32
+
+@torch.inference_mode()
+def encode_catalog(model, texts):
+    """編碼整個目錄並做 L2 正規化，之後內積即為 cosine 相似度"""
+    embeddings = model.encode(texts, convert_to_tensor=True)
+    return torch.nn.functional.normalize(embeddings, dim=1)
+
+def to_storage(device_embeddings, device):
+    return device_embeddings.to(device).to(embedding_dtype(device))
+
+def build_hnsw_index(device_embeddings):
+    """以正規化目錄向量建立內積 (= cosine) HNSW 索引；沒有 FAISS 或目錄太小時回傳 None"""
+    if faiss is None or len(device_embeddings) < HNSW_MIN_CATALOG_SIZE:
+        return None
+    embeddings = device_embeddings.float().cpu().numpy()
+    # 索引只用來取候選列 (之後以完整精度重新評分)，向量以 8-bit 純量量化儲存，記憶體為 fp32 的 1/4
+    index = faiss.IndexHNSWSQ(embeddings.shape[1], faiss.ScalarQuantizer.QT_8bit, HNSW_M,
+                              faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.train(embeddings)
+    index.add(embeddings)
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    return index
+
+def search_hnsw_index(index, query_embedding, k):
+    """回傳語意最接近的 k 列 (依列位置排序)"""
+    query = query_embedding.float().cpu().numpy().reshape(1, -1)
+    _, neighbors = index.search(query, min(k, index.ntotal))
+    return np.sort(neighbors[0][neighbors[0] >= 0])
+
+@torch.inference_mode()
+def encode_query(model, user_input, device):
+    return model.encode(user_input, convert_to_tensor=True,
+                        normalize_embeddings=True).to(device).float()
+
+def query_tensor(query_embedding, device):
+    """呼叫端已編碼 (且已正規化) 的 numpy 查詢向量，轉成與 encode_query 相同的裝置與精度
+
+    先複製一份，唯讀陣列 (例如快取共用的向量) 直接轉 tensor 會有警告。
+    """
+    return torch.from_numpy(np.array(query_embedding, dtype=np.float32)).to(device)
+
+@torch.inference_mode()
+def encode_queries(model, user_inputs, device, batch_size=64):
+    return model.encode(list(user_inputs), batch_size=batch_size, convert_to_tensor=True,
+                        normalize_embeddings=True, show_progress_bar=False).to(device).float()
+
+def semantic_similarity(query_embeddings, device_embeddings):
+    """query_embeddings 為 (D,) 或 (B, D)，回傳 (N,) 或 (B, N)"""
+    return query_embeddings.to(device_embeddings.dtype) @ device_embeddings.T
+
+def combine_scores(semantic_similarities, sensor_type_similarities, module_similarities,
+                   environment_similarities, sensor_type_weight, module_weight,
+                   semantic_weight, environment_weight):
+    """回傳 (5, B, N) 分數張量，依序為 final / 類型 / 模組 / 語意 / 環境
+
+    CPU 上算好的 (B, N) 匹配度搬到語意分數所在的裝置，綜合評分以 float64 計算。
+    """
+    device = semantic_similarities.device
+    semantic_scores = semantic_similarities.reshape(-1, semantic_similarities.shape[-1])
+
+    # 一次配置 (5, B, N)，各項匹配度直接寫入對應列，綜合評分以單一次加權縮併寫入第 0 列，
+    # 不產生逐項相乘相加的暫存張量
+    score_stack = torch.empty((5, *semantic_scores.shape), dtype=torch.float64, device=device)
+    score_stack[1].copy_(torch.as_tensor(np.asarray(sensor_type_similarities), dtype=torch.float64))
+    score_stack[2].copy_(torch.as_tensor(np.asarray(module_similarities), dtype=torch.float64))
+    score_stack[3].copy_(semantic_scores)
+    score_stack[4].copy_(torch.as_tensor(np.asarray(environment_similarities), dtype=torch.float64))
+
+    weights = torch.tensor([sensor_type_weight, module_weight, semantic_weight, environment_weight],
+                           dtype=torch.float64, device=device)
+    torch.tensordot(weights, score_stack[1:], dims=1, out=score_stack[0])
+    return score_stack
+
+def rank_candidates(score_stack, threshold, top_k):
+    """對每個查詢篩選門檻並取前 top_k，只把選中的索引與分數搬回 CPU
+
+    回傳每個查詢一個 (indices, scores) 或 None (沒有列通過門檻)，scores 形狀為 (5, k)。
+    """
+    final_scores = score_stack[0]
+    kept = final_scores >= threshold
+    kept_counts = kept.sum(dim=1).cpu().tolist()
+    k = min(top_k, final_scores.shape[1])
+
+    # topk 是部分選擇 (不排序全部 N 列)，未過門檻的列以 -inf 遮蔽
+    masked_scores = final_scores.masked_fill(~kept, float("-inf"))
+    top = torch.topk(masked_scores, k, dim=1).indices
+    top_scores = torch.gather(score_stack, 2, top.unsqueeze(0).expand(len(score_stack), -1, -1)).cpu().numpy()
+    top = top.cpu().numpy()
+
+    ranked = []
+    for i, kept_count in enumerate(kept_counts):
+        n = min(k, kept_count)
+        ranked.append((top[i, :n], top_scores[:, i, :n]) if n else None)
+    return ranked
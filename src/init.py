@@ -0,0 +1,292 @@
+"""系統初始化 (冷啟動時執行一次，可以慢)
+
+讀取感測器目錄 (CSV / Feather / Parquet)、解析逐列特徵、建立語意搜尋文字並編碼整個目錄；結果可快取到磁碟。
+"""
+import hashlib
+import os
+import re
+from contextlib import suppress
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+from sentence_transformers import SentenceTransformer
+
+from embed import encode_catalog, select_device, to_storage
+from intent import compile_any
+from scoring import prepare_module_codes
+
+# 預編譯的 regex
+TEMP_NUMBER_PATTERN = re.compile(r'-?\d+')
+MODULE_SUFFIX_PATTERN = re.compile(r'[（(].*?[）)]')
+
+MODEL_DIR = "./model"
+
+# 初始化結果 (前處理後的 DataFrame 與目錄向量) 的磁碟快取
+EMBEDDING_CACHE_DIR = ".cache"
+EMBEDDING_CACHE_VERSION = 3   # 前處理或搜尋文字邏輯變更時遞增，讓舊快取失效
+
+# 初始化
+def initialize_system(csv_file="sensors.csv", cache_dir=EMBEDDING_CACHE_DIR):
+    try:
+        cache_path = _embedding_cache_path(csv_file, MODEL_DIR, cache_dir) if cache_dir else None
+        cached = _load_embedding_cache(cache_path) if cache_path else None
+
+        if cached is not None:
+            df, device_embeddings = cached
+            print(f"載入 {len(df)} 筆感測器資料 (使用快取 {cache_path.name})")
+            prepare_module_codes(df)
+        else:
+            df = read_catalog(csv_file)
+            print(f"載入 {len(df)} 筆感測器資料")
+            
+            # 處理 compatible_modules 欄位
+            df["compatible_modules"] = df["compatible_modules"].fillna("")
+            df["parsed_modules"] = df["compatible_modules"].apply(parse_compatible_modules)
+            
+            # 預先計算與查詢無關的逐列特徵
+            prepare_row_features(df)
+
+            # 增強text
+            df["search_text"] = create_enhanced_search_text(df)
+
+        print("載入語意模型...")
+        device = select_device()
+        model = SentenceTransformer(MODEL_DIR, device=device)
+        # 只做推論：關閉 dropout (編碼時另以 inference_mode 略過 autograd)
+        model.eval()
+
+        if cached is None:
+            print("建立語意向量...")
+            device_embeddings = encode_catalog(model, df["search_text"].tolist())
+
+        device_embeddings = to_storage(device_embeddings, device)
+        if cached is None and cache_path:
+            _save_embedding_cache(cache_path, df, device_embeddings)
+        
+        print("系統初始化完成！")
+        return df, model, device_embeddings
+        
+    except Exception as e:
+        print(f"初始化錯誤：{e}")
+        return None, None, None
+
+def read_catalog(path):
+    """依副檔名讀取目錄：Feather / Parquet 欄位已有型別，不需逐字解析 CSV (需安裝 pyarrow)"""
+    suffix = Path(path).suffix.lower()
+    if suffix == ".feather":
+        return pd.read_feather(path)
+    if suffix == ".parquet":
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+def _embedding_cache_path(csv_file, model_dir, cache_dir):
+    """快取檔名由目錄檔內容、模型路徑與快取版本決定"""
+    digest = hashlib.sha256()
+    digest.update(Path(csv_file).read_bytes())
+    digest.update(str(model_dir).encode())
+    digest.update(str(EMBEDDING_CACHE_VERSION).encode())
+    return Path(cache_dir) / f"{digest.hexdigest()}.pt"
+
+def _load_embedding_cache(cache_path):
+    if not cache_path.exists():
+        return None
+    try:
+        cached = torch.load(cache_path, map_location="cpu", weights_only=False)
+        return cached["df"], cached["embeddings"].float()
+    except Exception as e:
+        print(f"讀取向量快取失敗，重新建立：{e}")
+        return None
+
+def _save_embedding_cache(cache_path, df, device_embeddings):
+    # 依執行時的儲存精度寫入 (GPU 為 fp16)，重新載入後的分數與冷啟動一致
+    # 先寫入暫存檔再原子替換，其他行程不會讀到寫到一半的快取
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        torch.save({"df": df, "embeddings": device_embeddings.detach().cpu()}, tmp_path)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        print(f"寫入向量快取失敗：{e}")
+        with suppress(OSError):
+            tmp_path.unlink(missing_ok=True)
+
+def parse_compatible_modules(modules_str):
+    if not modules_str or modules_str == "":
+        return []
+    
+    try:
+        cleaned = str(modules_str).strip('{}').replace('"', '').replace("'", "")
+        if not cleaned:
+            return []
+        modules = [module.strip() for module in cleaned.split(',')]
+        return [module for module in modules if module]
+    except Exception as e:
+        return []
+
+def _text_column(series, lower=False, upper=False):
+    text = series.astype(str).where(series.notna(), "")
+    if lower:
+        text = text.str.lower()
+    if upper:
+        text = text.str.upper()
+    return text
+
+def _contains_any(text, keywords):
+    return text.str.contains("|".join(re.escape(kw) for kw in keywords), regex=True).to_numpy(dtype=bool)
+
+def clean_module_name(module):
+    module_clean = MODULE_SUFFIX_PATTERN.sub('', module.lower())
+    return module_clean.replace("偵測器", "偵測")
+
+def prepare_row_features(df):
+    """將與使用者查詢無關的逐列解析 (溫度範圍、IP 等級、特徵文字) 一次算好存成欄位"""
+    # 缺值先補成空字串 (pandas 3 的 astype(str) 會保留 NaN，排除關鍵字比對需要字串)
+    type_clean = (df["type"].where(df["type"].notna(), "").astype(str).str.strip()
+                  if "type" in df.columns else pd.Series("", index=df.index))
+    df["_type_clean"] = type_clean.astype("category")
+
+    # 類型與 IP 等級重複值多，轉成 Categorical 讓比對以整數代碼進行
+    for column in ("type", "ip_rating"):
+        if column in df.columns:
+            df[column] = df[column].astype("category")
+
+    # 清理後的模組名稱，以及模組 -> 應用關鍵字組的比對 (含模糊比對) 只做一次
+    if "parsed_modules" in df.columns:
+        df["parsed_modules_clean"] = df["parsed_modules"].apply(
+            lambda modules: [clean_module_name(module) for module in modules])
+        prepare_module_codes(df)
+
+    # 工作溫度：需含 '-' 且至少兩個數字才視為範圍
+    temp_text = _text_column(df["operating_temp"]) if "operating_temp" in df.columns else pd.Series("", index=df.index)
+    temps = temp_text.str.findall(TEMP_NUMBER_PATTERN)
+    has_range = temp_text.str.contains("-", regex=False) & (temps.str.len() >= 2)
+    df["_min_temp"] = temps.str[0].where(has_range).astype(float)
+    df["_max_temp"] = temps.str[1].where(has_range).astype(float)
+
+    ip_upper = _text_column(df["ip_rating"], upper=True) if "ip_rating" in df.columns else pd.Series("", index=df.index)
+    df["_ip_upper"] = ip_upper.astype("category")
+    df["_features_lower"] = _text_column(df["features"], lower=True) if "features" in df.columns else ""
+
+    df["_supports_low_temp"] = (df["_min_temp"] <= -20).to_numpy(dtype=bool)
+    df["_has_waterproof_ip"] = _contains_any(df["_ip_upper"], ['IP65', 'IP66', 'IPX7'])
+    df["_has_ai_feature"] = _contains_any(df["_features_lower"], ['分析', '智能', '擴充', '平台'])
+    df["_has_realtime_feature"] = _contains_any(df["_features_lower"], ['即時', '連續', '持續'])
+    return df
+
+def _join_segments(*segments):
+    """逐列以空白串接非空的文字片段"""
+    joined = segments[0]
+    for segment in segments[1:]:
+        both = (joined != "") & (segment != "")
+        joined = np.where(both, np.char.add(np.char.add(joined, " "), segment), np.char.add(joined, segment))
+    return np.asarray(joined, dtype=str)
+
+def _repeat_column(df, column, times):
+    """'a' -> 'a a a'；欄位不存在或為空值的列為空字串"""
+    if column not in df.columns:
+        return np.full(len(df), "")
+    repeated = (_text_column(df[column]) + " ").str.repeat(times).str[:-1]
+    return repeated.where(df[column].notna(), "").to_numpy(dtype=str)
+
+def _tag_segment(mask, tags):
+    return np.where(mask, " ".join(tags), "")
+
+def create_enhanced_search_text(df):
+    """以欄位運算一次建立所有感測器的語意搜尋文字 (需先執行 prepare_row_features)"""
+    n = len(df)
+    empty = np.full(n, "")
+
+    # 感測器名稱和類型 (高權重)
+    name_segment = _repeat_column(df, "name", 5)
+    type_segment = _repeat_column(df, "type", 4)
+
+    # 相容模組 (最高權重)
+    module_segment = empty
+    if "parsed_modules" in df.columns:
+        modules = df["parsed_modules"].reset_index(drop=True).explode().dropna().astype(str)
+        if len(modules):
+            repeated = (modules + " ").str.repeat(4).str[:-1]
+            joined = repeated.groupby(level=0).agg(" ".join)
+            module_segment = joined.reindex(range(n), fill_value="").to_numpy(dtype=str)
+
+    # 特徵描述與應用關鍵字
+    features = _text_column(df["features"]) if "features" in df.columns else pd.Series("", index=df.index)
+    feature_segment = features.to_numpy(dtype=str)
+    keyword_segment = extract_application_keywords(features)
+
+    # 環境適用性資訊
+    env_segment = extract_environmental_suitability(df)
+
+    search_text = _join_segments(name_segment, type_segment, module_segment, feature_segment,
+                                 keyword_segment, env_segment)
+    return pd.Series(search_text, index=df.index, dtype=object)
+
+APPLICATION_PATTERNS = {
+    '室內監控': [r'室內', r'建築', r'辦公', r'機房'],
+    '安全監控': [r'監控', r'安全', r'預警', r'警報'],
+    '熱源偵測': [r'熱源', r'熱顯像', r'紅外線', r'溫度'],
+    '人員偵測': [r'人員', r'人像', r'人流', r'體溫'],
+    '火災預防': [r'火災', r'火源', r'煙霧', r'預警'],
+    '環境監測': [r'環境', r'氣候', r'空氣', r'品質'],
+    '工業應用': [r'工廠', r'工業', r'機械', r'設備'],
+    '農業應用': [r'農業', r'溫室', r'土壤', r'種植'],
+    '戶外應用': [r'戶外', r'森林', r'野外', r'氣象']
+}
+APPLICATION_MATCHERS = {
+    app_type: compile_any(patterns, flags=0) for app_type, patterns in APPLICATION_PATTERNS.items()
+}
+
+def extract_application_keywords(features_text):
+    """features_text 為文字欄位，回傳每列命中的應用類別標籤 (每個類別重複兩次)"""
+    segments = []
+    for app_type, matcher in APPLICATION_MATCHERS.items():
+        matched = features_text.str.contains(matcher, regex=True).to_numpy(dtype=bool)
+        segments.append(_tag_segment(matched, [app_type] * 2))
+    return _join_segments(*segments)
+
+def extract_environmental_suitability(df):
+    """依 IP 等級、工作溫度與功耗產生環境描述標籤 (需先執行 prepare_row_features)"""
+    n = len(df)
+    empty = np.full(n, "")
+
+    # IP等級
+    ip_segment = empty
+    if "ip_rating" in df.columns:
+        ip_present = df["ip_rating"].notna().to_numpy()
+        ip_upper = df["_ip_upper"]
+        dust_water = _contains_any(ip_upper, ['IP65', 'IP66'])
+        waterproof = _contains_any(ip_upper, ['IPX7', 'IPX8'])
+        labelled = ~ip_upper.isin(['未標示', '未指定']).to_numpy()
+        ip_segment = np.select(
+            [ip_present & dust_water, ip_present & waterproof, ip_present & labelled],
+            [" ".join(['防塵防水', '室外適用', '惡劣環境'] * 2), "防水 戶外可用", "環境保護"],
+            default="",
+        )
+
+    # 工作溫度
+    min_temp = df["_min_temp"].to_numpy()
+    max_temp = df["_max_temp"].to_numpy()
+    has_range = ~np.isnan(min_temp)
+    with np.errstate(invalid="ignore"):
+        indoor = (min_temp >= 0) & (max_temp <= 50)
+        temp_segment = _join_segments(
+            _tag_segment(has_range & (min_temp <= -20), ['極低溫', '嚴寒環境']),
+            _tag_segment(has_range & (max_temp >= 85), ['高溫', '工業環境']),
+            _tag_segment(has_range & indoor, ['室內環境', '一般環境']),
+            _tag_segment(has_range & ~indoor, ['寬溫範圍', '惡劣環境']),
+        )
+
+    # 功耗
+    power_segment = empty
+    if "power_consumption" in df.columns:
+        power = pd.to_numeric(df["power_consumption"], errors="coerce").to_numpy(dtype=float)
+        with np.errstate(invalid="ignore"):
+            power_segment = np.select(
+                [power <= 0.01, power <= 0.1],
+                ["超低功耗 電池供電", "低功耗 節能"],
+                default="",
+            )
+
+    return _join_segments(ip_segment, temp_segment, power_segment)
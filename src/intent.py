@@ -0,0 +1,149 @@
+"""使用者查詢意圖分析 (每次查詢執行，以預編譯 regex 掃描查詢字串)"""
+import re
+from functools import lru_cache
+from types import MappingProxyType
+
+def compile_any(patterns, flags=re.IGNORECASE):
+    """將同一類別的多個樣式合併為單一預編譯 regex，一次掃描即可判斷是否命中"""
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns), flags)
+
+# 直接感測器需求識別
+DIRECT_NEEDS_PATTERNS = {
+    '熱顯像': [r'紅外線.*熱顯像', r'熱顯像.*模組', r'熱顯像', r'熱像儀', r'體溫.*感測', r'溫度異常', r'紅外線.*影像'],
+    '毫米波雷達': [r'毫米波.*人流', r'毫米波.*模組', r'人流.*計算', r'人員.*追蹤', r'動線.*監控', r'人體.*偵測', r'毫米波雷達'],
+    '氣體感測': [r'氣體.*感測', r'氣體.*偵測', r'氣體.*檢測', r'co2.*感測', r'co₂.*感測', r'voc.*感測', r'空氣品質.*感測', r'臭氧.*感測', r'一氧化碳.*感測', r'氨氣.*感測', r'可燃氣體.*感測'],
+    '二氧化碳氣體感測': [r'二氧化碳.*感測', r'co2.*感測',r'co2', r'二氧化碳', r'co₂.*濃度', r'co2濃度', r'co2.*檢測', r'co₂(感測器|模組|設備)'],
+    '溫濕度': [r'溫濕度.*感測', r'溫度.*濕度.*監控',  r'溫濕度',r'環境.*溫濕度', r'溫度.*感測', r'濕度.*感測', r'室內.*溫度'],
+    '環境光感測': [r'光照.*感測', r'照度.*偵測', r'亮度.*監控', r'環境光.*感測'],
+    '傾斜/振動': [r'傾斜.*偵測', r'振動.*感測', r'角度.*感測', r'晃動.*感測', r'地震.*預警', r'結構.*監控',r'傾斜.*(感測器|模組|設備)?'],
+    '超音波風速風向': [r'風速.*感測', r'風向.*感測', r'風力.*偵測', r'風速風向', r'氣象.*監控', r'超音波.*風速']
+}
+
+ENVIRONMENTAL_CONTEXT_PATTERNS = {
+    '低溫環境': {
+        'patterns': [r'低溫.*環境', r'冷藏.*倉庫', r'冷凍.*環境', r'極低溫'],
+        'requirement': '低溫環境適用'
+    },
+    '高溫環境': {
+        'patterns': [r'高溫.*環境', r'極高溫'],
+        'requirement': '高溫環境適用'
+    },
+    '高濕環境': {
+        'patterns': [r'高濕.*環境', r'潮濕.*環境', r'濕度.*較高'],
+        'requirement': '抗濕環境'
+    },
+    '工業環境': {
+        'patterns': [r'工廠.*環境', r'工業.*現場', r'生產.*環境'],
+        'requirement': '工業級耐用性'
+    },
+    '室內環境': {
+        'patterns': [r'室內.*環境', r'建築.*內部', r'密閉.*空間'],
+        'requirement': '室內部署適用'
+    },
+    '戶外環境': {
+        'patterns': [r'戶外.*環境', r'野外.*應用', r'室外.*監控'],
+        'requirement': '戶外防護等級'
+    }
+}
+
+TECHNICAL_SPECS_PATTERNS = {
+    'AI功能': {
+        'patterns': [r'AI', r'人工智慧', r'機器學習', r'行為辨識', r'智能分析'],
+        'spec': 'AI擴充相容性'
+    },
+    '即時監控': {
+        'patterns': [r'即時', r'實時', r'連續監測', r'持續監控'],
+        'spec': '連續監控能力'
+    },
+    '無線傳輸': {
+        'patterns': [r'無線', r'wifi', r'藍牙', r'zigbee', r'lora'],
+        'spec': '無線通訊功能'
+    },
+    '低功耗': {
+        'patterns': [r'低功耗', r'省電', r'電池供電', r'節能'],
+        'spec': '低功耗設計'
+    },
+    '高精度': {
+        'patterns': [r'高精度', r'精確', r'準確度', r'精密'],
+        'spec': '高精度測量'
+    }
+}
+# === 應用領域識別 ===
+APPLICATION_DOMAIN_PATTERNS = {
+    '智慧農業': [r'農業', r'溫室', r'種植', r'農作物', r'灌溉'],
+    '工業監控': [r'工廠', r'生產線', r'機械', r'設備監控', r'預測維護'],
+    '建築安全': [r'建築', r'結構', r'安全監控', r'火災預警', r'安防'],
+    '環境監測': [r'環境', r'氣候', r'空氣品質', r'污染監測', r'氣象'],
+    '智慧城市': [r'城市', r'交通', r'公共設施', r'智慧路燈', r'人流統計']
+}
+
+DIRECT_NEEDS_MATCHERS = {
+    need_type: compile_any(patterns) for need_type, patterns in DIRECT_NEEDS_PATTERNS.items()
+}
+ENVIRONMENTAL_CONTEXT_MATCHERS = {
+    env_type: (compile_any(config['patterns']), config['requirement'])
+    for env_type, config in ENVIRONMENTAL_CONTEXT_PATTERNS.items()
+}
+TECHNICAL_SPECS_MATCHERS = {
+    tech_type: (compile_any(config['patterns']), config['spec'])
+    for tech_type, config in TECHNICAL_SPECS_PATTERNS.items()
+}
+APPLICATION_DOMAIN_MATCHERS = {
+    domain: compile_any(patterns) for domain, patterns in APPLICATION_DOMAIN_PATTERNS.items()
+}
+
+@lru_cache(maxsize=2048)
+def analyze_user_intent(user_input: str):
+    """分析使用者的具體需求意圖，區分直接需求和環境描述
+
+    結果依查詢字串快取 (同一次推薦會在多處分析同一查詢) 並由所有呼叫端共用，
+    因此回傳唯讀的 MappingProxyType，清單欄位轉成 tuple。
+    """
+    user_lower = user_input.lower()
+    comprehensive_analysis = {
+        # intent
+        'direct_sensor_needs': [],      # 直接的感測器需求
+        'environmental_context': [],    # 環境背景描述
+        'exclude_keywords': [],         # 需要排除的關鍵字
+        
+        # needs
+        'primary_application': None,    # 主要應用場景
+        'environment_needs': [],        # 環境適應需求
+        'technical_specs': [],          # 技術規格需求
+        'priority_features': [],        # 優先功能特性
+
+        'application_domain': None,     # 應用領域
+        'deployment_context': [],       # 部署環境
+        'performance_requirements': [] # 效能需求
+    }
+
+    # 1. 直接感測器需求
+    for need_type, matcher in DIRECT_NEEDS_MATCHERS.items():
+        if matcher.search(user_input):
+            comprehensive_analysis['direct_sensor_needs'].append(need_type)
+
+    # 2. 環境背景
+    for env_type, (matcher, requirement) in ENVIRONMENTAL_CONTEXT_MATCHERS.items():
+        if matcher.search(user_input):
+            comprehensive_analysis['environmental_context'].append(env_type)
+            comprehensive_analysis['environment_needs'].append(requirement)
+
+    # 3. 技術規格需求
+    for matcher, spec in TECHNICAL_SPECS_MATCHERS.values():
+        if matcher.search(user_input):
+            comprehensive_analysis['technical_specs'].append(spec)
+
+    # 4. 應用領域
+    for domain, matcher in APPLICATION_DOMAIN_MATCHERS.items():
+        if matcher.search(user_input):
+            comprehensive_analysis['application_domain'] = domain
+            break
+    # exclude_keywords
+    if any(ctx in comprehensive_analysis['environmental_context'] for ctx in ['低溫環境', '高濕環境','高溫環境']):
+        if '溫濕度' not in comprehensive_analysis['direct_sensor_needs']:
+            comprehensive_analysis['exclude_keywords'].append('溫濕度')
+
+    return MappingProxyType({
+        key: tuple(value) if isinstance(value, list) else value
+        for key, value in comprehensive_analysis.items()
+    })
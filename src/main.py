@@ -1,45 +1,67 @@
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from fastapi import Request
 from fastapi.exception_handlers import RequestValidationError
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
-import pandas as pd
-import numpy as np
 import traceback
+import time
+import asyncio
+import os
 import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime
+from collections import OrderedDict
+from functools import partial
 import json
+import orjson
 from pathlib import Path
-from bc_csv7 import RecommendationRequest
+from query_batcher import QueryBatcher
+from semantic_cache import SemanticCache
 import uvicorn
+import anyio.to_thread
 from fastapi.middleware.cors import CORSMiddleware
 
 
 
-# 導入原本的推薦系統
-from bc_csv7 import (
-    initialize_system, 
-    analyze_user_intent, 
-    recommend_advanced,
-    calculate_sensor_type_similarity,
-    calculate_module_similarity,
-    calculate_environment_similarity
-)
+# 導入原本的推薦系統：意圖分析只依賴 re，其餘 (pandas / torch / sentence-transformers) 在背景初始化時才載入
+from intent import analyze_user_intent
 
-# 設定日誌
-logging.basicConfig(level=logging.INFO)
+# 設定日誌：請求路徑只把紀錄放進佇列，由背景執行緒寫出，不在事件迴圈上做同步 I/O
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, logging.StreamHandler(), respect_handler_level=True)
+logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(log_queue)])
+log_listener.start()
 logger = logging.getLogger(__name__)
 
+# 同一處的同類錯誤第一次完整記錄，之後只抽樣記錄，避免大量重複錯誤灌爆日誌
+ERROR_LOG_SAMPLE_RATE = 0.01
+_logged_errors = set()
+
+def _log_exception(message, exc):
+    key = (message.split("：")[0], type(exc))
+    if key in _logged_errors and random.random() >= ERROR_LOG_SAMPLE_RATE:
+        return
+    _logged_errors.add(key)
+    logger.error(message, exc_info=exc)
+
+class ORJSONResponse(JSONResponse):
+    """以 orjson 序列化回應 (numpy 純量、datetime 可直接輸出)"""
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+
 # 創建 FastAPI 應用
 app = FastAPI(
     title="智慧感測器推薦系統",
     description="基於 AI 的感測器推薦 API",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 app.add_middleware(
@@ -49,21 +71,136 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-# 靜態文件和模板
-app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
+# 回應壓縮：推薦結果的 JSON 重複鍵多，壓縮率高；小回應不值得壓縮
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+# 靜態文件 (瀏覽器快取一小時)
+class CachedStaticFiles(StaticFiles):
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers.setdefault("Cache-Control", "public, max-age=3600")
+        return response
+
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
+
+# 首頁內容只在啟動時讀取一次
+INDEX_HTML_BYTES = (Path(__file__).parent / "index.html").read_bytes()
+
+# 伺服器併發設定
+THREADPOOL_SIZE = 100
+SERVER_CONCURRENCY_LIMIT = 200
+ENCODE_BATCH_SIZE = 16
+ENCODE_BATCH_WAIT = 0.005   # 秒
+# 推薦行程數：每個行程各持有一份目錄與目錄向量，預設不超過 4 個；目錄向量在 GPU 上時固定只用 1 個
+MAX_DEFAULT_PROCESSES = 4
+RECOMMEND_PROCESSES = int(os.environ.get("SENSOR_API_PROCESSES",
+                                         min(os.cpu_count() or 1, MAX_DEFAULT_PROCESSES)))
+
+# 感測器目錄檔 (CSV / Feather / Parquet，依副檔名選擇讀取方式)
+CATALOG_FILE = os.environ.get("SENSOR_CATALOG", "sensors.csv")
 
 # 全域變數儲存系統狀態
 system_state = {
     "df": None,
     "model": None,
     "device_embeddings": None,
+    "sensor_records": None,
+    "sensor_types": None,
+    "pool": None,
+    "batcher": None,
+    "init_task": None,
     "initialized": False,
     "error_message": None
 }
 
+# 查詢字串 -> 正規化向量，API 層只編碼一次並重用 (唯讀陣列，快取共用同一份)
+QUERY_EMBEDDING_CACHE_SIZE = 4096
+_query_embeddings = OrderedDict()
+
+def _encode_queries(queries):
+    import torch
+    
+    with torch.inference_mode():
+        return system_state["model"].encode(queries, batch_size=len(queries), normalize_embeddings=True,
+                                            convert_to_numpy=True, show_progress_bar=False)
+
+async def _embed(query: str):
+    embedding = _query_embeddings.get(query)
+    if embedding is not None:
+        _query_embeddings.move_to_end(query)
+        return embedding
+    
+    # 同時進來的查詢由 batcher 合併成一次編碼
+    embedding = await system_state["batcher"].embed(query)
+    _query_embeddings[query] = embedding
+    while len(_query_embeddings) > QUERY_EMBEDDING_CACHE_SIZE:
+        _query_embeddings.popitem(last=False)
+    return embedding
+
+SCORE_COLUMNS = ['final_score', 'sensor_type_similarity', 'module_similarity',
+                 'semantic_similarity', 'environment_similarity']
+
+# 回應中的文字欄位與缺值時的預設值
+TEXT_FIELDS = {
+    'name': '未知',
+    'type': '未分類',
+    'features': None,
+    'ip_rating': None,
+    'operating_temp': None,
+    'range': None,
+    'precision': None,
+}
+
+def _sensor_records(df):
+    """每款感測器可直接組成回應的欄位，以 df 索引為鍵，啟動時建立一次
+
+    缺值與型別以整欄一次處理 (回應模型以 model_construct 建立不做驗證，型別需在這裡先整理好)。
+    """
+    import pandas as pd
+    
+    def column_values(column, default):
+        if column not in df.columns:
+            return [default] * len(df)
+        values = df[column].astype(object)
+        return values.where(values.notna(), default).tolist()
+    
+    fields = {column: column_values(column, default) for column, default in TEXT_FIELDS.items()}
+    fields['compatible_modules'] = [modules if isinstance(modules, list) else []
+                                    for modules in column_values('parsed_modules', None)]
+    if 'power_consumption' in df.columns:
+        power = pd.to_numeric(df['power_consumption'], errors='coerce').astype(object)
+        fields['power_consumption'] = power.where(power.notna(), None).tolist()
+    else:
+        fields['power_consumption'] = [None] * len(df)
+    
+    return {label: dict(zip(fields, values)) for label, values in zip(df.index, zip(*fields.values()))}
+
+# 推薦運算在獨立行程池中執行 (recommend_worker)
+async def _recommend(query, query_embedding, **params):
+    from recommend_worker import run_recommend
+    
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(system_state["pool"],
+                                      partial(run_recommend, query, query_embedding, params))
+
+# 推薦回應的語意快取 (cosine >= 0.95、最多 1000 筆、5 分鐘過期)
+response_cache = SemanticCache(max_size=1000, ttl=300.0, threshold=0.95)
+
+def _analyze_query(query):
+    from scoring import query_signature
+    
+    return analyze_user_intent(query), query_signature(query)
+
 # Pydantic 模型定義
 
+class RecommendationRequest(BaseModel):
+    query: str = Field(..., min_length=1, max_length=500)
+    sensor_type_weight: float = Field(0.4, ge=0.0, le=1.0)
+    module_weight: float = Field(0.3, ge=0.0, le=1.0)
+    semantic_weight: float = Field(0.2, ge=0.0, le=1.0)
+    environment_weight: float = Field(0.1, ge=0.0, le=1.0)
+    threshold: float = Field(0.5, ge=0.0, le=1.0)
+    top_k: int = Field(5, ge=1, le=20)
+
 class SensorRecommendation(BaseModel):
     name: str
     type: str
@@ -94,33 +231,45 @@ class RecommendationResponse(BaseModel):
     intent_analysis: Optional[IntentAnalysis] = None
     recommendations: List[SensorRecommendation] = []
     total_found: int = 0
-    search_timestamp: str
+    search_timestamp: datetime  # 由 orjson 直接輸出 ISO 8601 字串
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
-    print("驗證錯誤：", exc)
-    return JSONResponse(
+    logger.warning(f"驗證錯誤：{exc}")
+    return ORJSONResponse(
         status_code=422,
         content={"detail": exc.errors(), "body": exc.body},
     )
 
+# 首頁路由
 @app.get("/", response_class=HTMLResponse)
 async def serve_homepage():
-    index_path = Path(__file__).parent / "index.html"
-    return HTMLResponse(index_path.read_text(encoding="utf-8"))
+    """返回主頁面"""
+    return HTMLResponse(INDEX_HTML_BYTES)
 
 # 系統初始化
-@app.on_event("startup")
-async def startup_event():
-    """應用啟動時初始化系統"""
+def _initialize():
+    """載入資料與模型 (在背景執行緒執行，期間 /health 等端點照常回應)"""
     try:
+        from bc_csv7 import initialize_system
+        from recommend_worker import start_pool
+        
         logger.info("正在初始化感測器推薦系統...")
-        df, model, device_embeddings = initialize_system("sensors.csv")
+        df, model, device_embeddings = initialize_system(CATALOG_FILE)
         
         if df is not None and model is not None and device_embeddings is not None:
             system_state["df"] = df
             system_state["model"] = model
             system_state["device_embeddings"] = device_embeddings
+            system_state["sensor_records"] = _sensor_records(df)
+            system_state["sensor_types"] = {
+                "sensor_types": df['type'].value_counts().to_dict(),
+                "total_sensors": len(df)
+            }
+            # spawn：子行程不繼承父行程的 torch / CUDA 狀態；全部行程就緒後才開始接受推薦請求
+            processes = 1 if device_embeddings.device.type == "cuda" else RECOMMEND_PROCESSES
+            # 推薦行程使用主行程的同一份目錄，df 索引與 sensor_records 一致
+            system_state["pool"] = start_pool(df, device_embeddings, processes)
             system_state["initialized"] = True
             logger.info(f"系統初始化成功，載入 {len(df)} 筆感測器資料")
         else:
@@ -131,28 +280,47 @@ async def startup_event():
         logger.error(f"系統初始化失敗：{e}")
         logger.error(traceback.format_exc())
 
-# 首頁路由
-@app.get("/", response_class=HTMLResponse)
-async def read_root(request: Request):
-    """返回主頁面"""
-    return templates.TemplateResponse("index.html", {
-        "request": request,
-        "system_ready": system_state["initialized"]
-    })
+@app.on_event("startup")
+async def startup_event():
+    """應用啟動時在背景初始化系統，不阻塞伺服器開始接受連線"""
+    # 查詢編碼在執行緒池中進行，放寬預設的 40 個執行緒上限
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    
+    system_state["batcher"] = QueryBatcher(_encode_queries, max_batch_size=ENCODE_BATCH_SIZE,
+                                           max_wait=ENCODE_BATCH_WAIT)
+    system_state["batcher"].start()
+    
+    # 保留 task 參考，避免背景工作被回收
+    system_state["init_task"] = asyncio.create_task(asyncio.to_thread(_initialize))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await system_state["batcher"].stop()
+    if system_state["pool"] is not None:
+        system_state["pool"].shutdown()
+    log_listener.stop()
+
+# 系統狀態檢查 (前端會輪詢，內容每秒最多重建一次)
+STATUS_REFRESH_INTERVAL = 1.0
+_status_cache = {"payload": None, "expires": 0.0}
 
-# 系統狀態檢查
 @app.get("/api/status")
 async def get_system_status():
     """檢查系統狀態"""
-    return {
-        "initialized": system_state["initialized"],
-        "error_message": system_state["error_message"],
-        "total_sensors": len(system_state["df"]) if system_state["df"] is not None else 0
-    }
+    now = time.monotonic()
+    if now >= _status_cache["expires"]:
+        _status_cache["payload"] = {
+            "initialized": system_state["initialized"],
+            "error_message": system_state["error_message"],
+            "total_sensors": len(system_state["df"]) if system_state["df"] is not None else 0,
+            "response_cache": response_cache.stats()
+        }
+        _status_cache["expires"] = now + STATUS_REFRESH_INTERVAL
+    return _status_cache["payload"]
 
 # 主要推薦 API
 
-@app.post("/api/recommend", response_model=RecommendationResponse)
+@app.post("/api/recommend")
 async def recommend_sensors(request: RecommendationRequest):
     """感測器推薦 API"""
     
@@ -164,15 +332,23 @@ async def recommend_sensors(request: RecommendationRequest):
         )
     
     try:
-        # 分析使用者意圖
-        intent = analyze_user_intent(request.query)
+        # 分析使用者意圖與關鍵字特徵
+        intent, signature = await anyio.to_thread.run_sync(_analyze_query, request.query)
+        
+        # 語意快取：意圖、關鍵字特徵與評分參數都相同的相近查詢直接回傳先前的回應
+        # (回應含意圖分析，且關鍵字分數佔綜合評分大半，不能只比語意向量)
+        query_embedding = await _embed(request.query)
+        cache_params = (tuple(intent.items()), signature,
+                        request.sensor_type_weight, request.module_weight, request.semantic_weight,
+                        request.environment_weight, request.threshold, request.top_k)
+        cached = response_cache.get(request.query, query_embedding, cache_params)
+        if cached is not None:
+            return ORJSONResponse({**cached, "search_timestamp": datetime.now()})
         
         # 執行推薦
-        result = recommend_advanced(
+        result = await _recommend(
             request.query,
-            system_state["df"],
-            system_state["model"],
-            system_state["device_embeddings"],
+            query_embedding,
             sensor_type_weight=request.sensor_type_weight,
             module_weight=request.module_weight,
             semantic_weight=request.semantic_weight,
@@ -188,51 +364,20 @@ async def recommend_sensors(request: RecommendationRequest):
         if result is not None and not result.empty:
             total_found = len(result)
             
-            for _, row in result.iterrows():
-                # 安全地獲取值
-                def safe_get(key, default=None):
-                    try:
-                        val = row.get(key, default)
-                        if pd.isna(val):
-                            return default
-                        return val
-                    except:
-                        return default
-                
-                # 處理相容模組
-                modules = safe_get('parsed_modules', [])
-                if not isinstance(modules, list):
-                    modules = []
-                
-                recommendation = SensorRecommendation(
-                    name=safe_get('name', '未知'),
-                    type=safe_get('type', '未分類'),
-                    final_score=round(safe_get('final_score', 0.0), 3),
-                    sensor_type_similarity=round(safe_get('sensor_type_similarity', 0.0), 3),
-                    module_similarity=round(safe_get('module_similarity', 0.0), 3),
-                    semantic_similarity=round(safe_get('semantic_similarity', 0.0), 3),
-                    environment_similarity=round(safe_get('environment_similarity', 0.0), 3),
-                    compatible_modules=modules,
-                    features=safe_get('features'),
-                    ip_rating=safe_get('ip_rating'),
-                    power_consumption=safe_get('power_consumption'),
-                    operating_temp=safe_get('operating_temp'),
-                    range=safe_get('range'),
-                    precision=safe_get('precision')
-                )
+            sensor_records = system_state["sensor_records"]
+            for label, scores in zip(result.index, result[SCORE_COLUMNS].itertuples(index=False, name=None)):
+                recommendation = SensorRecommendation.model_construct(**sensor_records[label],
+                                                                      **dict(zip(SCORE_COLUMNS, scores)))
                 recommendations.append(recommendation)
         
-        print("使用者輸入：", request.query)
-        print("門檻值與推薦數量：", request.threshold, request.top_k)
-
-        # 建立意圖分析結果
-        intent_analysis = IntentAnalysis(
-            direct_sensor_needs=intent.get('direct_sensor_needs', []),
-            environmental_context=intent.get('environmental_context', []),
-            exclude_keywords=intent.get('exclude_keywords', []),
+        # 建立意圖分析結果 (以 model_construct 略過驗證；快取的意圖為唯讀 tuple，這裡轉回 list)
+        intent_analysis = IntentAnalysis.model_construct(
+            direct_sensor_needs=list(intent.get('direct_sensor_needs', ())),
+            environmental_context=list(intent.get('environmental_context', ())),
+            exclude_keywords=list(intent.get('exclude_keywords', ())),
             primary_application=intent.get('primary_application'),
-            environment_needs=intent.get('environment_needs', []),
-            technical_specs=intent.get('technical_specs', [])
+            environment_needs=list(intent.get('environment_needs', ())),
+            technical_specs=list(intent.get('technical_specs', ()))
         )
         
         # 生成回應訊息
@@ -241,18 +386,21 @@ async def recommend_sensors(request: RecommendationRequest):
         else:
             message = "很抱歉，沒有找到符合需求的感測器，請嘗試調整搜尋條件"
         
-        return RecommendationResponse(
+        response = RecommendationResponse.model_construct(
             success=True,
             message=message,
             intent_analysis=intent_analysis,
             recommendations=recommendations,
             total_found=total_found,
-            search_timestamp=datetime.now().isoformat()
+            search_timestamp=datetime.now()
         )
+        # 直接序列化，不經 response_model 再驗證一次
+        payload = response.model_dump()
+        response_cache.put(request.query, query_embedding, cache_params, payload)
+        return ORJSONResponse(payload)
         
     except Exception as e:
-        logger.error(f"推薦過程發生錯誤：{e}")
-        logger.error(traceback.format_exc())
+        _log_exception(f"推薦過程發生錯誤：{e}", e)
         raise HTTPException(status_code=500, detail=f"推薦過程發生錯誤：{str(e)}")
 
 # 快速搜尋 API（簡化版）
@@ -265,11 +413,9 @@ async def quick_search(q: str, limit: int = 5):
     
     try:
         # 使用預設參數進行快速搜尋
-        result = recommend_advanced(
+        result = await _recommend(
             q,
-            system_state["df"],
-            system_state["model"],
-            system_state["device_embeddings"],
+            await _embed(q),
             threshold=0.3,
             top_k=limit
         )
@@ -278,23 +424,25 @@ async def quick_search(q: str, limit: int = 5):
             return {"results": [], "total": 0}
         
         # 簡化回應格式
-        results = []
-        for _, row in result.iterrows():
-            results.append({
-                "name": row.get('name', '未知'),
-                "type": row.get('type', '未分類'),
-                "score": round(row.get('final_score', 0.0), 3),
-                "features": row.get('features', ''),
-                "modules": row.get('parsed_modules', [])
-            })
+        sensor_records = system_state["sensor_records"]
+        results = [
+            {
+                "name": sensor_records[label]['name'],
+                "type": sensor_records[label]['type'],
+                "score": score,
+                "features": sensor_records[label]['features'] or '',
+                "modules": sensor_records[label]['compatible_modules']
+            }
+            for label, score in zip(result.index, result['final_score'].tolist())
+        ]
         
         return {"results": results, "total": len(results)}
         
     except Exception as e:
-        logger.error(f"快速搜尋錯誤：{e}")
+        _log_exception(f"快速搜尋錯誤：{e}", e)
         raise HTTPException(status_code=500, detail=f"搜尋失敗：{str(e)}")
 
-# 獲取感測器類型統計
+# 獲取感測器類型統計 (資料載入後不再變動，初始化時算好)
 @app.get("/api/sensor-types")
 async def get_sensor_types():
     """獲取感測器類型統計"""
@@ -302,18 +450,7 @@ async def get_sensor_types():
     if not system_state["initialized"]:
         raise HTTPException(status_code=503, detail="系統尚未就緒")
     
-    try:
-        df = system_state["df"]
-        type_counts = df['type'].value_counts().to_dict()
-        
-        return {
-            "sensor_types": type_counts,
-            "total_sensors": len(df)
-        }
-        
-    except Exception as e:
-        logger.error(f"獲取感測器類型統計錯誤：{e}")
-        raise HTTPException(status_code=500, detail=f"獲取統計失敗：{str(e)}")
+    return ORJSONResponse(system_state["sensor_types"], headers={"Cache-Control": "public, max-age=60"})
 
 # 健康檢查
 @app.get("/health")
@@ -321,7 +458,7 @@ async def health_check():
     """健康檢查端點"""
     return {
         "status": "healthy" if system_state["initialized"] else "unhealthy",
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": datetime.now(),
         "system_ready": system_state["initialized"]
     }
 
@@ -329,38 +466,52 @@ async def health_check():
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
     """HTTP 異常處理器"""
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=exc.status_code,
         content={
             "success": False,
             "message": exc.detail,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now()
         }
     )
 
 @app.exception_handler(Exception)
 async def general_exception_handler(request: Request, exc: Exception):
     """一般異常處理器"""
-    logger.error(f"未處理的異常：{exc}")
-    logger.error(traceback.format_exc())
+    _log_exception(f"未處理的異常：{exc}", exc)
     
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={
             "success": False,
             "message": "內部伺服器錯誤，請稍後再試",
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now()
         }
     )
 
 # 主程式入口
 if __name__ == "__main__":
     
-    # 開發模式配置
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=8001,
-        reload=True,
-        log_level="info"
-    )
+    if os.environ.get("SENSOR_API_DEV"):
+        # 開發模式配置：自動重新載入 (只能單一 worker)
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=8001,
+            reload=True,
+            log_level="info"
+        )
+    else:
+        # 正式環境配置：uvloop + httptools，不重新載入；多核心平行由推薦行程池負責，預設單一 worker
+        # (每個 worker 會再建立自己的行程池與模型副本)
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=8001,
+            loop="uvloop",
+            http="httptools",
+            reload=False,
+            workers=int(os.environ.get("SENSOR_API_WORKERS", 1)),
+            limit_concurrency=SERVER_CONCURRENCY_LIMIT,
+            log_level="warning"
+        )
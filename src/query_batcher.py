@@ -0,0 +1,56 @@
+"""查詢編碼微批次：把同時進來的查詢合併成一次 model.encode，避免 Transformer 一次只跑一筆
+
+背景協程從佇列取出第一筆後，最多再等 max_wait 秒或湊滿 max_batch_size 筆，
+在執行緒池中編碼整批，再透過各自的 Future 回傳結果。
+"""
+import asyncio
+
+import anyio.to_thread
+
+class QueryBatcher:
+    def __init__(self, encode, max_batch_size: int = 16, max_wait: float = 0.005):
+        self.encode = encode                # list[str] -> (B, D) 已正規化的 numpy 陣列
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def embed(self, query: str):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((query, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            self._drain(batch)
+            if len(batch) < self.max_batch_size:
+                await asyncio.sleep(self.max_wait)
+                self._drain(batch)
+
+            try:
+                embeddings = await anyio.to_thread.run_sync(self.encode, [query for query, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            # 整批共用同一塊記憶體，設為唯讀避免呼叫端互相影響
+            embeddings.setflags(write=False)
+            for (_, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+
+    def _drain(self, batch):
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
@@ -0,0 +1,62 @@
+"""推薦行程池：在獨立行程中執行 recommend_advanced，不阻塞 API 的事件迴圈也不受 GIL 限制
+
+查詢向量由 API 行程編碼後傳入；推薦行程直接接收 API 行程前處理好的目錄與目錄向量
+(不讀磁碟、不載入語意模型)。本模組只依賴推薦邏輯本身，spawn 出的行程不會載入 FastAPI 應用。
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import torch
+
+from bc_csv7 import recommend_advanced
+from embed import build_hnsw_index, select_device, to_storage
+from scoring import prepare_module_codes
+
+_worker_state = {}
+
+def start_pool(df, device_embeddings, processes):
+    """建立行程池並等待所有行程完成初始化 (spawn 的行程池只在送出工作時才建立行程)"""
+    ctx = multiprocessing.get_context("spawn")
+    pool = ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=ctx,
+        initializer=_init_worker,
+        initargs=(df, device_embeddings.cpu(), processes, ctx.Barrier(processes))
+    )
+    try:
+        for future in [pool.submit(_worker_ready) for _ in range(processes)]:
+            future.result()
+    except Exception:
+        pool.shutdown(cancel_futures=True)
+        raise
+    return pool
+
+def run_recommend(query, query_embedding, params):
+    return recommend_advanced(
+        query,
+        _worker_state["df"],
+        None,
+        _worker_state["device_embeddings"],
+        query_embedding=query_embedding,
+        index=_worker_state["index"],
+        use_cache=False,        # API 層已有 response_cache (門檻 0.95)，不再經過 0.87 的查詢快取
+        **params
+    )
+
+def _init_worker(df, embeddings, processes, ready):
+    # 多個行程同時在 CPU 上運算時，每個行程只用一個執行緒，避免執行緒數超過核心數
+    device = select_device()
+    if processes > 1 and device == "cpu":
+        torch.set_num_threads(1)
+
+    # 模組代碼表是行程內的全域狀態，依相同列順序重建，代碼與 API 行程一致
+    # (初始化失敗直接拋出例外，行程池會中斷 (BrokenProcessPool)，不會默默回傳空結果)
+    prepare_module_codes(df)
+    device_embeddings = to_storage(embeddings, device)
+    # 大型目錄改用 HNSW 索引取候選列；沒有 FAISS 或目錄小時為 None，退回暴力計算
+    index = build_hnsw_index(device_embeddings)
+    _worker_state.update(df=df, device_embeddings=device_embeddings, index=index, ready=ready)
+
+def _worker_ready():
+    # 每個預熱工作都等到所有行程完成初始化才返回，確保 N 個預熱工作分散在 N 個不同行程
+    _worker_state["ready"].wait()
@@ -0,0 +1,319 @@
+"""逐列匹配度評分 (每次查詢執行，受直譯器開銷限制)
+
+只使用 initialize_system 預先算好的欄位做向量化運算，不逐列迭代、不做 regex 解析。
+"""
+from difflib import get_close_matches
+
+import numpy as np
+
+from intent import analyze_user_intent
+
+# 感測器類型匹配度計算
+
+# 感測器類型關鍵字
+SENSOR_TYPE_KEYWORDS = {
+    '熱顯像': {
+        'primary': ['熱顯像', '紅外線', '熱源', '火源', '體溫', '溫度影像', '人員追蹤', '熱成像'],
+        'secondary': ['無接觸', '監控'],
+        # 'exclude': ['傾斜', '振動']
+    },
+    '溫濕度': {
+        'primary': ['溫度', '濕度', '溫濕度', '環境溫度', '環境濕度','空氣濕潤度'],
+        'secondary': ['監控', '控制', '農業', '環境', '溫室', '機房', '倉儲']
+    },
+
+    '氣體感測': {
+        'primary': ['氨氣', '氣體', '空氣品質', '一氧化碳', '二氧化碳','co2', 'co₂', "甲烷", "VOC", "氣體檢測", "氣體洩漏",
+                    '可燃氣體','空氣品質監控', '室內空氣', '通風','空氣監測', '空氣檢測','排風','氣體濃度'],
+        'secondary': ['工業監控', '氣體洩漏'],
+    },
+    '毫米波雷達': {
+        'primary': ['毫米波', '雷達', '人流', '人數統計', '動線追蹤'],
+        'secondary': ['人員偵測', '流量統計'],
+    },
+    '超音波風速風向': {
+        'primary': ['風速', '風向', '氣象', '風力'],
+        'secondary': ['氣象', '氣候'],
+    },
+    '環境光感測': {
+        'primary': ['光照', '照度', '亮度', '環境光', '光度','光照度','日照強度'],
+        'secondary': ['農業', '日照', '光源'],
+    },
+    '傾斜/振動': {
+        'primary': ['傾斜', '振動', '角度', '穩定性監測', '機械振動', '結構監測'],
+        'secondary': ['機械監測', '設備監控'],
+    },        
+    '二氧化碳氣體感測': {
+        'primary': ['CO2', 'CO₂', '二氧化碳', '空氣品質', '空氣監測', 'co2', 'co₂',  '二氧化碳濃度', 
+        'CO2濃度', "ppm",'火災'],
+        'secondary': ['通風', '空調', '室內環境'],
+    },
+    
+}
+
+class KeywordIndex:
+    """把多組關鍵字表攤平成不重複詞表與 (組數 × 詞數) 計數矩陣
+
+    查詢時每個不重複的關鍵字只比對一次，各組的命中數由一次矩陣乘法得到。
+    """
+
+    def __init__(self, keyword_groups, fields):
+        self.names = list(keyword_groups)
+        self.vocabulary = list(dict.fromkeys(
+            kw for kws in keyword_groups.values() for field in fields for kw in kws[field]))
+        position = {kw: i for i, kw in enumerate(self.vocabulary)}
+        self.counts = {}
+        self.lengths = {}
+        for field in fields:
+            counts = np.zeros((len(self.names), len(self.vocabulary)), dtype=np.int64)
+            for row, kws in enumerate(keyword_groups.values()):
+                for kw in kws[field]:
+                    counts[row, position[kw]] += 1
+            self.counts[field] = counts
+            self.lengths[field] = np.array([len(kws[field]) for kws in keyword_groups.values()])
+
+    def hits(self, user_lower):
+        """詞表中每個關鍵字是否出現在查詢中"""
+        return np.array([kw in user_lower for kw in self.vocabulary], dtype=np.int64)
+
+    def matches(self, user_lower):
+        """回傳 {field: 各組命中數}"""
+        hits = self.hits(user_lower)
+        return {field: counts @ hits for field, counts in self.counts.items()}
+
+SENSOR_TYPE_INDEX = KeywordIndex(SENSOR_TYPE_KEYWORDS, ('primary', 'secondary'))
+
+def _sensor_type_divisors(primary_lengths, secondary_lengths):
+    """依主要關鍵字數量決定各類型的正規化除數"""
+    primary_lengths = primary_lengths.astype(float)
+    secondary_lengths = secondary_lengths.astype(float)
+    primary_divisors = np.select([primary_lengths > 12, primary_lengths > 5],
+                                 [primary_lengths / 2.5, primary_lengths / 1.7],
+                                 default=primary_lengths / 1.4)
+    secondary_divisors = np.where(primary_lengths > 5, secondary_lengths / 1.3, secondary_lengths / 1)
+    return primary_divisors, secondary_divisors
+
+SENSOR_TYPE_DIVISORS = _sensor_type_divisors(SENSOR_TYPE_INDEX.lengths['primary'],
+                                             SENSOR_TYPE_INDEX.lengths['secondary'])
+
+def sensor_type_scores(user_lower):
+    """每個感測器類型對此查詢的關鍵字分數 (沒有主要關鍵字命中的類型不列入)"""
+    matches = SENSOR_TYPE_INDEX.matches(user_lower)
+    primary_divisors, secondary_divisors = SENSOR_TYPE_DIVISORS
+    primary_score = np.minimum(matches['primary'] / primary_divisors * 4, 1.0)
+    secondary_score = np.minimum(matches['secondary'] / secondary_divisors * 0.3, 0.2)
+    scores = np.minimum(primary_score + secondary_score, 1.0)
+    return {name: score for name, score, hit in zip(SENSOR_TYPE_INDEX.names, scores, matches['primary']) if hit}
+
+def calculate_sensor_type_similarity(user_input: str, df: "pd.DataFrame"):
+    intent = analyze_user_intent(user_input)
+    user_lower = user_input.lower()
+
+    # 每個類型只計算一次關鍵字匹配，再廣播到所有同類型的列
+    type_score = sensor_type_scores(user_lower)
+
+    # 以類別為單位計分，再用整數代碼取回每列分數
+    types = df['_type_clean'].cat
+    categories = types.categories
+    category_scores = np.array([type_score.get(t, 0.0) for t in categories], dtype=float)
+
+    # 直接需求給高分
+    category_scores[categories.isin(intent['direct_sensor_needs'])] = 0.9
+
+    # 排除指定關鍵字
+    excluded = [any(ex in t for ex in intent['exclude_keywords']) for t in categories]
+    category_scores[np.array(excluded, dtype=bool)] = 0.0
+
+    # 代碼 -1 (缺值) 對應最後補上的 0 分
+    similarities = np.append(category_scores, 0.0)[types.codes.to_numpy()]
+
+    return similarities
+
+# 模組應用關鍵字
+APPLICATION_KEYWORDS = {
+    '溫濕度監控偵測': {
+        'primary': ['溫度', '濕度', '溫濕度', '環境溫度', '環境濕度'],
+        'secondary': ['農業', '氣候', '環境監控'],
+        'context': ['持續監測', '記錄', '感測'],
+    },
+    '火災預警偵測': {
+        'primary': ['火災', '火源', '熱源', '安全監控', '預警', '熱顯像', 'co2', 'CO₂','二氧化碳','濃度'],
+        'secondary': ['建築安全', '監控系統', '紅外線', '溫度監測'],
+        'context': ['即時', '自動', '警報', '偵測'],
+    },
+    '火災預警偵測(wifi)': {
+        'primary': ['火災', '無線', 'wifi', '遠端監控', '熱顯像', 'co2', 'CO₂' , '二氧化碳','濃度'],
+        'secondary': ['物聯網', 'iot', '雲端', '無線傳輸'],
+        'context': ['即時傳輸', '遠端', '無線通訊'],
+    },
+    '體溫偵測': {
+        'primary': ['體溫', '紅外線感測', '熱顯像', '額溫偵測'],
+        'secondary': ['發燒', '體表溫度', '醫療偵測', '健康監控'],
+        'context': ['即時傳輸', '遠端', '不接觸'],
+    },
+    '氣候光照偵測': {
+        'primary': ['光照', '照度', '環境光', '氣候', 'co2', 'CO₂','二氧化碳'],
+        'secondary': ['農業', '植物生長', '溫室', '環境監測'],
+        'context': ['光線感測', '氣候監控', '環境參數'],
+    },
+    '土壤氣候整合偵測': {
+        'primary': ['土壤', '氣候', '農業', '種植', 'co2','CO₂', '光照', '溫濕度'],
+        'secondary': ['智慧農業', '精準農業', '植物生長'],
+        'context': ['整合監測', '多參數', '農業應用'],
+    },
+    '無CO2土壤氣候偵測': {
+        'primary': ['土壤', '氣候', '光照', '環境監測', '無co2'],
+        'secondary': ['簡化監測', '基礎農業', '環境感測'],
+        'context': ['基本參數', '成本優化'],
+    },
+    '人流計算與氨氣感測': {
+        'primary': ['人流', '人數統計', '氨氣', '毫米波', '雷達', '空氣品質', '空氣監控','空氣異味','有害氣體', '空氣','人潮','排風','換氣'],
+        'secondary': ['空氣品質', '人員統計','通風','排風系統','除臭','空間使用'],
+        'context': ['雷達偵測', '氣體監測', '雙重功能'],
+    },
+    '森林應用監測': {
+        'primary': ['森林', '風力', '風向', '風速', '戶外監測'],
+        'secondary': ['氣象', '環境監測', '野外應用'],
+        'context': ['超音波', '氣象參數', '戶外環境'],
+    },
+    '傾斜偵測': {
+        'primary': ['傾斜', '角度', '穩定性', '結構監測', '振動'],
+        'secondary': ['建築安全', '結構健康', '設備監控'],
+        'context': ['雙軸', '精密測量', '安全監控'],
+    },
+    '馬達偵測': {
+        'primary': ['馬達', '振動', '設備監控', '機械', '傾斜'],
+        'secondary': ['工業設備', '預測維護', '機械健康'],
+        'context': ['設備診斷', '振動分析', '預防保養'],
+    }
+}
+APPLICATION_KEYS_LOWER = [key.lower() for key in APPLICATION_KEYWORDS]
+APPLICATION_INDEX = KeywordIndex(APPLICATION_KEYWORDS, ('primary', 'secondary', 'context'))
+APPLICATION_TOTALS = (APPLICATION_INDEX.lengths['primary'] * 0.4 +
+                      APPLICATION_INDEX.lengths['secondary'] * 0.07 +
+                      APPLICATION_INDEX.lengths['context'] * 0.02)
+
+def application_key_scores(user_lower):
+    """每個應用關鍵字組對此查詢的分數"""
+    matches = APPLICATION_INDEX.matches(user_lower)
+    weight = (matches['primary'] * 1 + matches['secondary'] * 0.2 + matches['context'] * 0.05)
+    return dict(zip(APPLICATION_INDEX.names, weight / APPLICATION_TOTALS))
+
+# 清理後模組名稱 -> 對應的應用關鍵字組 (None 表示無對應)，初始化時預先填入
+MODULE_TO_KEY = {}
+
+# 清理後模組名稱的整數代碼，初始化時依資料順序建立；評分時以代碼查表，不再逐次處理字串
+MODULE_NAMES = []
+MODULE_CODES = {}
+
+def prepare_module_codes(df):
+    """把每列的清理後模組轉成整數代碼陣列 (_module_codes) 與模組數 (_module_count)
+
+    沒有模組的列記為 [-1]，對應查表時補在最後的 0 分。新出現的模組同時填入 MODULE_TO_KEY。
+    """
+    def encode(modules):
+        if not modules:
+            return np.array([-1], dtype=np.int32)
+        for module_clean in modules:
+            if module_clean not in MODULE_CODES:
+                MODULE_CODES[module_clean] = len(MODULE_NAMES)
+                MODULE_NAMES.append(module_clean)
+                match_application_key(module_clean)
+        return np.array([MODULE_CODES[module_clean] for module_clean in modules], dtype=np.int32)
+
+    if "parsed_modules_clean" in df.columns:
+        df["_module_codes"] = df["parsed_modules_clean"].map(encode)
+        df["_module_count"] = df["_module_codes"].map(len).astype(np.int64)
+
+def match_application_key(module_clean):
+    """以子字串比對、再以模糊比對找出模組對應的應用關鍵字組，結果快取在 MODULE_TO_KEY"""
+    if module_clean in MODULE_TO_KEY:
+        return MODULE_TO_KEY[module_clean]
+
+    matched_key = None
+    for key, key_lower in zip(APPLICATION_KEYWORDS, APPLICATION_KEYS_LOWER):
+        if module_clean in key_lower or key_lower in module_clean:
+            matched_key = key
+            break
+
+    if not matched_key:
+        matched_keys = get_close_matches(module_clean, APPLICATION_KEYS_LOWER, n=1, cutoff=0.6)
+        if matched_keys:
+            matched_key = next((k for k in APPLICATION_KEYWORDS if k.lower() == matched_keys[0]), None)
+
+    MODULE_TO_KEY[module_clean] = matched_key
+    return matched_key
+
+def calculate_module_similarity(user_input: str, df):
+    user_lower = user_input.lower()
+
+    # 每個應用關鍵字組對此查詢只計算一次
+    key_similarities = application_key_scores(user_lower)
+
+    if '_module_codes' not in df.columns:
+        return np.zeros(len(df))
+
+    if len(df) == 0:
+        return np.zeros(0)
+
+    # 每個模組代碼對此查詢只評分一次 (最後一格給沒有模組的列)
+    module_scores = np.array([
+        1.0 if module_clean in user_lower else key_similarities.get(MODULE_TO_KEY[module_clean], 0.0)
+        for module_clean in MODULE_NAMES
+    ] + [0.0])
+
+    # 各列的模組代碼在攤平後連續排列，各列最大值即為分段 reduceat
+    entry_scores = module_scores[np.concatenate(df['_module_codes'].to_numpy())]
+    segment_starts = np.concatenate(([0], np.cumsum(df['_module_count'].to_numpy())[:-1]))
+    similarities = np.maximum.reduceat(entry_scores, segment_starts)
+
+    return np.minimum(similarities, 1)
+
+# 環境需求關鍵字
+ENV_REQUIREMENTS = {
+    '低溫環境': ['低溫', '冷藏', '冷凍', '極低溫'],
+    '高濕環境': ['高濕', '潮濕', '抗濕'],
+    'AI擴充': ['AI', '人工智慧', '機器學習', '行為辨識'],
+    '即時監控': ['即時', '實時', '連續監測'],
+    '人員追蹤': ['人員', '移動軌跡', '追蹤', '行為']
+}
+
+def calculate_environment_similarity(user_input: str, df):
+    user_lower = user_input.lower()
+    
+    # 逐列特徵已在 prepare_row_features 預先計算，這裡只做向量運算
+    env_score = np.zeros(len(df))
+    
+    # 低溫環境適用性
+    if any(keyword in user_lower for keyword in ENV_REQUIREMENTS['低溫環境']):
+        env_score += np.where(df['_supports_low_temp'].to_numpy(), 0.3, 0.0)
+    
+    # 高濕環境抗性
+    if any(keyword in user_lower for keyword in ENV_REQUIREMENTS['高濕環境']):
+        env_score += np.where(df['_has_waterproof_ip'].to_numpy(), 0.2, 0.0)
+    
+    # AI擴充能力
+    if any(keyword in user_lower for keyword in ENV_REQUIREMENTS['AI擴充']):
+        env_score += np.where(df['_has_ai_feature'].to_numpy(), 0.2, 0.0)
+    
+    # 即時監控能力
+    if any(keyword in user_lower for keyword in ENV_REQUIREMENTS['即時監控']):
+        env_score += np.where(df['_has_realtime_feature'].to_numpy(), 0.15, 0.0)
+    
+    return np.minimum(env_score, 1.0)
+
+def query_signature(user_input: str):
+    """類型、模組、環境匹配度所依賴的全部查詢特徵
+
+    簽章相同的兩個查詢在同一份目錄上得到完全相同的關鍵字分數，只有語意分數不同。
+    """
+    intent = analyze_user_intent(user_input)
+    user_lower = user_input.lower()
+    return (
+        intent['direct_sensor_needs'],
+        intent['exclude_keywords'],
+        SENSOR_TYPE_INDEX.hits(user_lower).tobytes(),
+        APPLICATION_INDEX.hits(user_lower).tobytes(),
+        tuple(i for i, module_clean in enumerate(MODULE_NAMES) if module_clean in user_lower),
+        tuple(any(kw in user_lower for kw in kws) for kws in ENV_REQUIREMENTS.values()),
+    )
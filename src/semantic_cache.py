@@ -0,0 +1,93 @@
+"""API 層語意快取：相近查詢 (cosine >= 門檻) 在相同評分參數下直接重用整份推薦回應
+
+查詢向量需預先 L2 正規化，內積即為 cosine 相似度。
+向量存在預先配置的 (max_size, D) 矩陣中，查詢時以一次矩陣向量乘法比對所有有效格位。
+"""
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+class SemanticCache:
+    def __init__(self, max_size: int = 1000, ttl: float = 300.0, threshold: float = 0.95):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self._slots = OrderedDict()                 # (query, params) -> 格位，LRU 順序
+        self._embeddings = None                     # (max_size, D)，第一次寫入時依向量維度配置
+        self._valid = np.zeros(max_size, dtype=bool)
+        self._created = np.zeros(max_size)          # 建立時間 (time.monotonic)
+        self._param_hashes = np.zeros(max_size, dtype=np.int64)
+        self._entries = [None] * max_size           # 格位 -> (key, params, response)
+        self._free = list(range(max_size - 1, -1, -1))
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query: str, query_embedding, params: tuple):
+        """回傳快取的回應 dict，沒有命中時回傳 None"""
+        self._expire()
+
+        key = (query, params)
+        if key in self._slots:
+            return self._hit(self._slots[key])
+
+        candidates = self._valid & (self._param_hashes == hash(params))
+        if candidates.any():
+            scores = np.where(candidates, self._embeddings @ np.asarray(query_embedding, dtype=np.float32),
+                              -np.inf)
+            best = int(np.argmax(scores))
+            # 雜湊相同不代表參數相同，命中前再比對一次
+            if scores[best] >= self.threshold and self._entries[best][1] == params:
+                return self._hit(best)
+
+        self.misses += 1
+        return None
+
+    def put(self, query: str, query_embedding, params: tuple, response: dict):
+        key = (query, params)
+        embedding = np.asarray(query_embedding, dtype=np.float32)
+        if self._embeddings is None:
+            self._embeddings = np.zeros((self.max_size, embedding.shape[-1]), dtype=np.float32)
+
+        if key in self._slots:
+            slot = self._slots[key]
+            self._slots.move_to_end(key)
+        else:
+            if not self._free:
+                _, evicted = self._slots.popitem(last=False)
+                self._release(evicted)
+            slot = self._free.pop()
+            self._slots[key] = slot
+
+        self._embeddings[slot] = embedding
+        self._valid[slot] = True
+        self._created[slot] = time.monotonic()
+        self._param_hashes[slot] = hash(params)
+        self._entries[slot] = (key, params, response)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._slots),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _hit(self, slot):
+        self.hits += 1
+        key, _, response = self._entries[slot]
+        self._slots.move_to_end(key)
+        return response
+
+    def _release(self, slot):
+        self._valid[slot] = False
+        self._entries[slot] = None
+        self._free.append(slot)
+
+    def _expire(self):
+        # LRU 順序不等於建立順序 (命中會移到尾端)，以建立時間陣列一次找出過期格位
+        expired = np.flatnonzero(self._valid & (self._created < time.monotonic() - self.ttl))
+        for slot in expired.tolist():
+            del self._slots[self._entries[slot][0]]
+            self._release(slot)